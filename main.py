@@ -7,17 +7,44 @@ Uses # %% cells for interactive execution in IDEs like VSCode or Jupyter.
 # %%
 import yaml
 import os
+import multiprocessing
+
+# GDAL settings for reading remote COGs and block handling, set before
+# rasterio is imported (GDAL_NUM_THREADS follows once the config is loaded).
+# Values already set in the environment take precedence.
+GDAL_ENV_DEFAULTS = {
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'GDAL_HTTP_MULTIPLEX': 'YES',
+    'GDAL_HTTP_VERSION': '2',
+    'VSI_CACHE': 'TRUE',
+    'VSI_CACHE_SIZE': '536870912',
+    'CPL_VSIL_CURL_USE_HEAD': 'NO',
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif,.tiff,.jp2',
+    'GDAL_CACHEMAX': '512',
+    'GDAL_SWATH_SIZE': '268435456',
+    'GDAL_MAX_DATASET_POOL_SIZE': '512'
+}
+for key, value in GDAL_ENV_DEFAULTS.items():
+    os.environ.setdefault(key, value)
+
 import numpy as np
+import rasterio
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from pathlib import Path
-from src.aoi_handler import load_aoi, create_square_aoi_from_coordinates, create_overall_bounding_aoi
+from src.aoi_handler import (
+    load_aoi,
+    create_overall_bounding_aoi,
+    buffer_features,
+    create_square_aoi_from_coordinates
+)
 from src.sentinel2_query import search_sentinel2_images
 from src.image_processor import (
-    load_and_crop_bands,
-    resample_to_resolution,
+    process_date,
     normalize_for_display,
     export_geotiff,
     export_jpeg,
     write_metadata_doc,
+    read_profile_sidecar,
     crop_from_existing_tif
 )
 
@@ -26,6 +53,36 @@ from src.image_processor import (
 with open('config.yaml', 'r') as f:
     config = yaml.safe_load(f)
 
+# Print debug statistics (full passes over every image array)
+DEBUG = config.get('debug', False)
+
+# Worker processes for the dates must be forked: this script has no
+# __main__ guard, so spawn/forkserver workers would re-run it on import
+if config.get('executor', 'thread') == 'process' and 'fork' not in multiprocessing.get_all_start_methods():
+    raise ValueError('executor: "process" needs the fork start method, not available on this platform. Use executor: "thread".')
+
+# One pool runs the dates of all AOIs, threads by default (mostly waiting on
+# remote tile reads), processes to also parallelize the NumPy work. Its
+# workers, and the HTTP connections GDAL keeps per thread, are reused
+# across dates and AOIs instead of being set up again for every AOI.
+if config.get('executor', 'thread') == 'process':
+    date_executor = ProcessPoolExecutor(
+        max_workers=config.get('workers', 4),
+        mp_context=multiprocessing.get_context('fork')
+    )
+else:
+    date_executor = ThreadPoolExecutor(max_workers=config.get('workers', 4))
+
+# GDAL threads (compression, warping) per date: the parallel dates share the cores
+os.environ.setdefault(
+    'GDAL_NUM_THREADS',
+    str(max(1, (os.cpu_count() or 1) // config.get('workers', 4)))
+)
+
+# Per-deploy GDAL overrides, these replace values from the environment
+for key, value in (config.get('gdal') or {}).items():
+    os.environ[key] = str(value)
+
 print("=" * 80)
 print("SENTINEL-2 TRUE COLOR IMAGE DOWNLOADER")
 print("=" * 80)
@@ -69,160 +126,107 @@ def process_aoi(location_name, aoi_geometry, bounds, start_date, end_date, confi
     print(f"Processing {len(dates_dict)} dates for {location_name}...")
     print(f"{'='*60}")
     
+    # Create output subdirectories for this location once
+    location_safe = location_name.replace(' ', '_')
+    
+    # Use output_folder if provided, otherwise use location_name
+    folder_name = output_folder.replace(' ', '_') if output_folder else location_safe
+    
+    output_dir = Path(config['output']['base_dir'])
+    tif_location_dir = output_dir / config['output']['tif_subdir'] / folder_name
+    jpg_location_dir = output_dir / config['output']['jpg_subdir'] / folder_name
+    
+    tif_location_dir.mkdir(parents=True, exist_ok=True)
+    jpg_location_dir.mkdir(parents=True, exist_ok=True)
+    
+    # List existing outputs once instead of checking every file per date
+    existing_tif_files = set(os.listdir(tif_location_dir))
+    existing_jpg_files = set(os.listdir(jpg_location_dir))
+    
+    # Collect output paths and dates that still need processing
+    output_paths = {}
+    pending_dates = []
     for idx, (date, items) in enumerate(sorted(dates_dict.items()), 1):
-        print(f"\n[{idx}/{len(dates_dict)}] Processing {date}...")
-        print(f"  Tiles to mosaic: {len(items)}")
-        
-        # Calculate average cloud cover
-        avg_cloud = sum(item.properties.get('eo:cloud_cover', 0) for item in items) / len(items)
-        print(f"  Average cloud cover: {avg_cloud:.1f}%")
-        
-        # Create output filenames with location-specific subdirectories
-        location_safe = location_name.replace(' ', '_')
         date_str = date.replace('-', '')
         base_filename = f"{location_safe}_{date_str}"
         
-        # Use output_folder if provided, otherwise use location_name
-        folder_name = output_folder.replace(' ', '_') if output_folder else location_safe
-        
-        # Create subdirectories for this location
-        tif_location_dir = os.path.join(
-            config['output']['base_dir'],
-            config['output']['tif_subdir'],
-            folder_name
-        )
-        jpg_location_dir = os.path.join(
-            config['output']['base_dir'],
-            config['output']['jpg_subdir'],
-            folder_name
-        )
-        
-        # Ensure directories exist
-        os.makedirs(tif_location_dir, exist_ok=True)
-        os.makedirs(jpg_location_dir, exist_ok=True)
-        
-        tif_path = os.path.join(tif_location_dir, f"{base_filename}.tif")
-        jpg_path = os.path.join(jpg_location_dir, f"{base_filename}.jpg")
+        tif_path = tif_location_dir / f"{base_filename}.tif"
+        jpg_path = jpg_location_dir / f"{base_filename}.jpg"
+        output_paths[date] = (tif_path, jpg_path)
         
         # Check if files already exist
-        files_exist = os.path.exists(tif_path) and os.path.exists(jpg_path)
+        files_exist = (
+            f"{base_filename}.tif" in existing_tif_files
+            and f"{base_filename}.jpg" in existing_jpg_files
+        )
         
         if files_exist:
-            print(f"  ℹ️  Images already exist")
-            
+            print(f"\n[{idx}/{len(dates_dict)}] {date}: ℹ️  Images already exist")
+        else:
+            pending_dates.append((idx, date, items))
+    
+    # Process dates in parallel on the run-wide date pool
+    use_processes = config.get('executor', 'thread') == 'process'
+    processed_profiles = {}
+    futures = {
+        date_executor.submit(
+            process_date,
+            date,
+            # Worker processes get plain dicts and rebuild (and re-sign) the items
+            [item.to_dict() for item in items] if use_processes else items,
+            aoi_geometry,
+            *output_paths[date],
+            config,
+            debug=DEBUG,
+            progress=f"[{idx}/{len(dates_dict)}]"
+        ): date
+        for idx, date, items in pending_dates
+    }
+    for future in as_completed(futures):
+        processed_profiles[futures[future]] = future.result()
+    
+    # Write metadata documentation once: doc.txt is shared by all dates of a
+    # location, so it documents the latest date with an available image
+    for date, items in sorted(dates_dict.items(), reverse=True):
+        tif_path, _ = output_paths[date]
+        
+        if date in processed_profiles:
+            profile = processed_profiles[date]
+            if profile is None:
+                continue
+            print(f"\n  {date}: Writing metadata documentation...")
+        else:
             # Always (re)generate doc.txt even if images exist
-            print(f"  Regenerating metadata documentation...")
+            print(f"\n  {date}: Regenerating metadata documentation...")
             try:
-                # Need to get profile from existing TIF file
-                import rasterio
-                with rasterio.open(tif_path) as src:
-                    profile = src.profile.copy()
-                    from rasterio.transform import array_bounds
-                    profile['bounds'] = array_bounds(
-                        profile['height'],
-                        profile['width'],
-                        profile['transform']
-                    )
+                # Get profile from the sidecar written with the TIF, if present
+                profile = None
+                if tif_path.with_suffix('.profile.json').name in existing_tif_files:
+                    profile = read_profile_sidecar(tif_path)
                 
-                write_metadata_doc(
-                    os.path.dirname(tif_path),
-                    location_name,
-                    date,
-                    items,
-                    profile,
-                    config
-                )
-                print(f"  ✓ Metadata updated!")
+                if profile is None:
+                    # Fall back to reading the profile from the existing TIF file
+                    with rasterio.open(tif_path) as src:
+                        profile = src.profile.copy()
+                        from rasterio.transform import array_bounds
+                        profile['bounds'] = array_bounds(
+                            profile['height'],
+                            profile['width'],
+                            profile['transform']
+                        )
             except Exception as e:
                 print(f"  ⚠ Could not generate metadata: {str(e)}")
-            
-            continue
-        
-        try:
-            # Load, mosaic, and crop bands
-            print(f"  Loading and mosaicking {len(items)} tile(s)...")
-            rgb_array, profile = load_and_crop_bands(
-                items,
-                aoi_geometry,
-                config['bands']
-            )
-            
-            # Debug: Check raw data values
-            print(f"  DEBUG - Raw data shape: {rgb_array.shape}")
-            print(f"  DEBUG - Raw data type: {rgb_array.dtype}")
-            print(f"  DEBUG - Raw data range: min={rgb_array.min()}, max={rgb_array.max()}")
-            print(f"  DEBUG - Non-zero pixels: {np.count_nonzero(rgb_array)}/{rgb_array.size}")
-            
-            # Check for valid data
-            if rgb_array.max() == 0:
-                print(f"  ⚠ WARNING: All pixel values are zero! Skipping...")
                 continue
-            
-            # Resample to target resolution
-            print(f"  Checking resolution...")
-            rgb_array, profile = resample_to_resolution(
-                rgb_array,
-                profile,
-                config['output']['target_resolution']
-            )
-            
-            # Print final image info
-            width_m = profile['width'] * config['output']['target_resolution']
-            height_m = profile['height'] * config['output']['target_resolution']
-            print(f"  Final image: {profile['width']} x {profile['height']} pixels")
-            print(f"  Coverage area: {width_m/1000:.2f} x {height_m/1000:.2f} km")
-            
-            # Debug: Check resampled data
-            print(f"  DEBUG - Resampled data range: min={rgb_array.min()}, max={rgb_array.max()}")
-            for i, band_name in enumerate(['Red', 'Green', 'Blue']):
-                band = rgb_array[:, :, i]
-                print(f"  DEBUG - {band_name} band: min={band.min()}, max={band.max()}, mean={band.mean():.2f}")
-            
-            # Export GeoTIFF
-            print(f"  Exporting GeoTIFF...")
-            export_geotiff(rgb_array, profile, tif_path)
-            
-            # Normalize for JPEG display (official Sentinel Hub method)
-            print(f"  Normalizing for display...")
-            rgb_normalized = normalize_for_display(rgb_array)
-            
-            # Debug: Check normalized data
-            print(f"  DEBUG - Normalized data range: min={rgb_normalized.min()}, max={rgb_normalized.max()}")
-            
-            # Export JPEG
-            print(f"  Exporting JPEG...")
-            export_jpeg(
-                rgb_normalized,
-                jpg_path,
-                quality=config['output']['jpg_quality']
-            )
-            
-            # Write metadata documentation
-            print(f"  Writing metadata documentation...")
-            # Profile needs bounds for metadata
-            if 'bounds' not in profile:
-                from rasterio.transform import array_bounds
-                profile['bounds'] = array_bounds(
-                    profile['height'],
-                    profile['width'],
-                    profile['transform']
-                )
-            write_metadata_doc(
-                os.path.dirname(tif_path),  # Use TIF directory (same as JPG)
-                location_name,
-                date,
-                items,
-                profile,
-                config
-            )
-            
-            print(f"  ✓ Successfully processed!")
-            
-        except Exception as e:
-            print(f"  ✗ Error processing image: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            continue
+        
+        write_metadata_doc(
+            tif_location_dir,  # Use TIF directory (same as JPG)
+            location_name,
+            date,
+            items,
+            profile,
+            config
+        )
+        break
 
 
 # %%
@@ -241,18 +245,20 @@ if 'shapefile_aois' in config and config['shapefile_aois']:
         print(f"\nLoading AOI from shapefile...")
         print(f"  Path: {aoi_config['aoi_shapefile']}")
         
-        aoi_gdf, aoi_geometry, bounds = load_aoi(aoi_config['aoi_shapefile'])
+        # Check if we should use bounding box instead of exact geometries
+        use_bounding_box = aoi_config.get('use_bounding_box', False)
+        
+        aoi_gdf, aoi_geometry, bounds = load_aoi(
+            aoi_config['aoi_shapefile'],
+            union_method=aoi_config.get('union_method', 'unary'),
+            use_bounding_box=use_bounding_box
+        )
         print(f"  Features: {len(aoi_gdf)}")
         print(f"  Bounds: {bounds}")
         print(f"  CRS: {aoi_gdf.crs}")
         
-        # Check if we should use bounding box instead of exact geometries
-        use_bounding_box = aoi_config.get('use_bounding_box', False)
         if use_bounding_box and len(aoi_gdf) > 1:
             print(f"  Using full bounding box (not just feature geometries)")
-            # Create a box from the bounds
-            from shapely.geometry import box
-            aoi_geometry = box(*bounds)
         
         # Check if we should process as single AOI or individual features
         process_as_single = aoi_config.get('process_as_single', True)
@@ -277,15 +283,19 @@ if 'shapefile_aois' in config and config['shapefile_aois']:
             shared_folder = aoi_config.get('shared_folder', False)
             crop_from_existing = aoi_config.get('crop_from_existing', None)
             
-            # Check if id_field exists, otherwise use index
+            # Get feature IDs, use 1-based index if id_field doesn't exist
             if id_field not in aoi_gdf.columns:
                 print(f"  Warning: ID field '{id_field}' not found, using index instead")
-                use_index = True
+                feature_ids = np.arange(1, len(aoi_gdf) + 1)
             else:
-                use_index = False
+                feature_ids = aoi_gdf[id_field].to_numpy()
             
+            # Get feature geometries, buffered if specified (in a UTM CRS)
             if buffer_meters > 0:
                 print(f"  Buffer: {buffer_meters}m around each feature")
+                feature_geometries = buffer_features(aoi_gdf, buffer_meters).to_numpy()
+            else:
+                feature_geometries = aoi_gdf.geometry.to_numpy()
             
             if shared_folder:
                 print(f"  Output: All features in single folder '{aoi_config['location_name']}'")
@@ -316,38 +326,19 @@ if 'shapefile_aois' in config and config['shapefile_aois']:
                 
                 print(f"  Found {len(source_tifs)} source TIF file(s)")
                 
+                # Extract dates from source filenames once for all features
+                # Format: Ahrtal_20210718.tif -> 20210718
+                source_dates = []
+                for source_tif_path in source_tifs:
+                    source_filename = os.path.basename(source_tif_path)
+                    date_str = source_filename.replace(f"{crop_from_existing}_", "").replace(".tif", "")
+                    source_dates.append((source_tif_path, source_filename, date_str))
+                
                 # Process each feature by cropping from existing TIFs
-                for idx, row in aoi_gdf.iterrows():
-                    # Get feature ID
-                    if use_index:
-                        feature_id = idx + 1
-                    else:
-                        feature_id = row[id_field]
-                    
+                for idx, (feature_id, feature_geometry) in enumerate(zip(feature_ids, feature_geometries), 1):
                     location_name = f"{aoi_config['location_name']}_R{feature_id}"
-                    feature_geometry = row['geometry']
                     
-                    # Apply buffer if specified
-                    if buffer_meters > 0:
-                        from shapely.ops import transform
-                        import pyproj
-                        
-                        centroid = feature_geometry.centroid
-                        center_lon = centroid.x
-                        center_lat = centroid.y
-                        
-                        utm_zone = int((center_lon + 180) / 6) + 1
-                        hemisphere = 'north' if center_lat >= 0 else 'south'
-                        utm_epsg = 32600 + utm_zone if hemisphere == 'north' else 32700 + utm_zone
-                        
-                        wgs84_to_utm = pyproj.Transformer.from_crs("EPSG:4326", f"EPSG:{utm_epsg}", always_xy=True).transform
-                        utm_to_wgs84 = pyproj.Transformer.from_crs(f"EPSG:{utm_epsg}", "EPSG:4326", always_xy=True).transform
-                        
-                        feature_utm = transform(wgs84_to_utm, feature_geometry)
-                        buffered_utm = feature_utm.buffer(buffer_meters)
-                        feature_geometry = transform(utm_to_wgs84, buffered_utm)
-                    
-                    print(f"\n  [{idx+1}/{len(aoi_gdf)}] Processing feature {feature_id} from existing TIFs...")
+                    print(f"\n  [{idx}/{len(aoi_gdf)}] Processing feature {feature_id} from existing TIFs...")
                     
                     # Determine output folder
                     folder_name = aoi_config['location_name'] if shared_folder else location_name
@@ -367,14 +358,10 @@ if 'shapefile_aois' in config and config['shapefile_aois']:
                     os.makedirs(tif_location_dir, exist_ok=True)
                     os.makedirs(jpg_location_dir, exist_ok=True)
                     
+                    location_safe = location_name.replace(' ', '_')
+                    
                     # Process each source TIF file
-                    for source_tif_path in source_tifs:
-                        # Extract date from source filename
-                        source_filename = os.path.basename(source_tif_path)
-                        # Format: Ahrtal_20210718.tif -> 20210718
-                        date_str = source_filename.replace(f"{crop_from_existing}_", "").replace(".tif", "")
-                        
-                        location_safe = location_name.replace(' ', '_')
+                    for source_tif_path, source_filename, date_str in source_dates:
                         base_filename = f"{location_safe}_{date_str}"
                         
                         tif_path = os.path.join(tif_location_dir, f"{base_filename}.tif")
@@ -409,45 +396,13 @@ if 'shapefile_aois' in config and config['shapefile_aois']:
                 print(f"\n✓ Completed processing {len(aoi_gdf)} features from existing TIFs")
                 continue  # Skip the normal processing below
             
-            for idx, row in aoi_gdf.iterrows():
-                # Get feature ID
-                if use_index:
-                    feature_id = idx + 1  # 1-based index
-                else:
-                    feature_id = row[id_field]
-                
+            for idx, (feature_id, feature_geometry) in enumerate(zip(feature_ids, feature_geometries), 1):
                 # Create location name with feature ID
                 location_name = f"{aoi_config['location_name']}_R{feature_id}"
                 
-                # Get geometry for this feature
-                feature_geometry = row['geometry']
-                
-                # Apply buffer if specified (need to project to metric CRS first)
-                if buffer_meters > 0:
-                    # Get center for UTM zone calculation
-                    centroid = feature_geometry.centroid
-                    center_lon = centroid.x
-                    center_lat = centroid.y
-                    
-                    # Determine UTM zone
-                    utm_zone = int((center_lon + 180) / 6) + 1
-                    hemisphere = 'north' if center_lat >= 0 else 'south'
-                    utm_epsg = 32600 + utm_zone if hemisphere == 'north' else 32700 + utm_zone
-                    
-                    # Project to UTM, buffer, project back
-                    from shapely.ops import transform
-                    import pyproj
-                    
-                    wgs84_to_utm = pyproj.Transformer.from_crs("EPSG:4326", f"EPSG:{utm_epsg}", always_xy=True).transform
-                    utm_to_wgs84 = pyproj.Transformer.from_crs(f"EPSG:{utm_epsg}", "EPSG:4326", always_xy=True).transform
-                    
-                    feature_utm = transform(wgs84_to_utm, feature_geometry)
-                    buffered_utm = feature_utm.buffer(buffer_meters)
-                    feature_geometry = transform(utm_to_wgs84, buffered_utm)
-                
                 feature_bounds = feature_geometry.bounds
                 
-                print(f"\n  [{idx+1}/{len(aoi_gdf)}] Processing feature {feature_id}...")
+                print(f"\n  [{idx}/{len(aoi_gdf)}] Processing feature {feature_id}...")
                 print(f"    Location: {location_name}")
                 if buffer_meters > 0:
                     print(f"    Original bounds (buffered by {buffer_meters}m)")
@@ -566,27 +521,14 @@ if 'coordinate_aois' in config and config['coordinate_aois'].get('coordinates')
             # Get buffer from config (default 500m)
             buffer_meters = coord_config.get('overall_buffer_meters', 500)
             
-            aoi_gdf, aoi_geometry, bounds = create_overall_bounding_aoi(
+            aoi_gdf, aoi_geometry, bounds, aoi_utm_area = create_overall_bounding_aoi(
                 coord_config['coordinates'],
                 coord_config['square_size_meters'],
                 buffer_meters=buffer_meters
             )
             
-            # Calculate coverage area
-            from shapely.ops import transform
-            import pyproj
-            
-            # Get center for UTM zone calculation
-            center_lon = (bounds[0] + bounds[2]) / 2
-            center_lat = (bounds[1] + bounds[3]) / 2
-            utm_zone = int((center_lon + 180) / 6) + 1
-            hemisphere = 'north' if center_lat >= 0 else 'south'
-            utm_epsg = 32600 + utm_zone if hemisphere == 'north' else 32700 + utm_zone
-            
-            # Project to UTM to get area in km²
-            project_to_utm = pyproj.Transformer.from_crs("EPSG:4326", f"EPSG:{utm_epsg}", always_xy=True).transform
-            aoi_utm = transform(project_to_utm, aoi_geometry)
-            area_km2 = aoi_utm.area / 1_000_000
+            # Coverage area (measured in UTM by create_overall_bounding_aoi)
+            area_km2 = aoi_utm_area / 1_000_000
             
             print(f"  Bounds (WGS84): {bounds}")
             print(f"  Total coverage area: {area_km2:.2f} km²")
@@ -641,6 +583,8 @@ print(f"  GeoTIFF files: {config['output']['tif_subdir']}/")
 print(f"  JPEG files: {config['output']['jpg_subdir']}/")
 print(f"  True color method: Official Sentinel Hub (linear gain)")
 
+date_executor.shutdown()
+
 
 
 # %%
@@ -1,35 +1,137 @@
 """Functions for handling AOI from shapefile and coordinates."""
 
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
 import geopandas as gpd
-from shapely.geometry import box, Point
+import shapely
+from shapely.geometry import box, Polygon
+from shapely.errors import GEOSException, UnsupportedGEOSVersionError
 import pyproj
 from pyproj import Transformer
 
 
-def load_aoi(shapefile_path):
+def _is_wgs84(crs):
+    """Check if a CRS is WGS84, also for WKT definitions without an EPSG code."""
+    return crs.to_epsg() == 4326 or crs.equals("EPSG:4326", ignore_axis_order=True)
+
+
+def _is_utm(crs):
+    """Check if a CRS is a UTM zone, where buffer distances in meters hold on the ground.
+    
+    Other metric CRS like Web Mercator (EPSG:3857) distort distances too much.
+    """
+    return crs.utm_zone is not None
+
+
+# Exterior ring of a unit square around the origin, in shapely's box() order
+_SQUARE_RING_X = np.array([1.0, 1.0, -1.0, -1.0, 1.0])
+_SQUARE_RING_Y = np.array([-1.0, 1.0, 1.0, -1.0, -1.0])
+
+
+@lru_cache(maxsize=128)
+def _get_transformers(utm_epsg):
+    """Get cached WGS84 <-> UTM transformers for a UTM zone.
+    
+    Args:
+        utm_epsg: EPSG code of the UTM zone
+        
+    Returns:
+        tuple: (wgs84_to_utm, utm_to_wgs84) pyproj Transformers
+    """
+    return (
+        Transformer.from_crs("EPSG:4326", f"EPSG:{utm_epsg}", always_xy=True),
+        Transformer.from_crs(f"EPSG:{utm_epsg}", "EPSG:4326", always_xy=True)
+    )
+
+
+def load_aoi(shapefile_path, union_method="unary", use_bounding_box=False):
     """Load AOI from shapefile and return geometry and bounds.
     
     Args:
         shapefile_path: Path to shapefile
+        union_method: Method used to merge multiple features ("unary" or
+                      "coverage"). "coverage" is faster but only valid for
+                      non-overlapping polygons, e.g. tile grids.
+        use_bounding_box: Use the bounding box of all features as geometry
+                          instead of their union (no union is computed)
         
     Returns:
         tuple: (GeoDataFrame, unified geometry, bounds)
     """
     gdf = gpd.read_file(shapefile_path)
     
+    if gdf.crs is None:
+        raise ValueError(f"Shapefile has no CRS defined: {shapefile_path}")
+    
     # Reproject to WGS84 if needed
-    if gdf.crs.to_epsg() != 4326:
+    if not _is_wgs84(gdf.crs):
+        source_crs = gdf.crs
+        source_geometry = gdf.geometry
         gdf = gdf.to_crs(epsg=4326)
+        
+        # Keep UTM source geometries so features can be buffered
+        # without a WGS84 -> UTM -> WGS84 round trip
+        if _is_utm(source_crs):
+            gdf['source_geometry'] = source_geometry
     
-    # Unary union to get single geometry
-    aoi_geometry = gdf.unary_union
+    # Get bounds (minx, miny, maxx, maxy) directly from the features
+    bounds = tuple(float(v) for v in gdf.total_bounds)
     
-    # Get bounds (minx, miny, maxx, maxy)
-    bounds = aoi_geometry.bounds
+    # Union to get single geometry (nothing to merge for a single feature)
+    if len(gdf) == 1:
+        aoi_geometry = gdf.geometry.iloc[0]
+    elif use_bounding_box:
+        aoi_geometry = box(*bounds)
+    elif hasattr(gdf, 'union_all'):
+        try:
+            aoi_geometry = gdf.union_all(method=union_method)
+        except (ValueError, NotImplementedError, UnsupportedGEOSVersionError, GEOSException):
+            # Coverage union needs a recent GEOS and non-overlapping
+            # polygons, fall back to default method
+            aoi_geometry = gdf.union_all()
+    else:
+        # geopandas < 1.0
+        aoi_geometry = gdf.unary_union
     
     return gdf, aoi_geometry, bounds
 
 
+def buffer_features(gdf, buffer_meters):
+    """Buffer each feature of an AOI by a distance in meters.
+    
+    Features are buffered in the shapefile's own CRS when it is a UTM zone,
+    otherwise each feature is buffered in its UTM zone.
+    
+    Args:
+        gdf: GeoDataFrame in WGS84 as returned by load_aoi
+        buffer_meters: Buffer distance in meters
+        
+    Returns:
+        GeoSeries: Buffered geometries in WGS84, aligned with the GeoDataFrame index
+    """
+    if 'source_geometry' in gdf.columns:
+        return gdf['source_geometry'].buffer(buffer_meters).to_crs(epsg=4326)
+    
+    # Determine the UTM zone of every feature from its center
+    centroids = shapely.centroid(gdf.geometry.to_numpy())
+    lons = shapely.get_x(centroids)
+    lats = shapely.get_y(centroids)
+    utm_zones = ((lons + 180) // 6).astype(int) + 1
+    utm_epsgs = np.where(lats >= 0, 32600, 32700) + utm_zones
+    
+    # Project all features of a zone to UTM, buffer and project back at once
+    buffered_parts = []
+    for utm_epsg in np.unique(utm_epsgs):
+        zone_geometries = gdf.geometry[utm_epsgs == utm_epsg]
+        buffered_parts.append(
+            zone_geometries.to_crs(epsg=int(utm_epsg)).buffer(buffer_meters).to_crs(epsg=4326)
+        )
+    
+    return pd.concat(buffered_parts).loc[gdf.index]
+
+
 def create_square_aoi_from_coordinates(lat, lon, square_size_meters):
     """Create a square AOI around a coordinate point.
     
@@ -41,47 +143,47 @@ def create_square_aoi_from_coordinates(lat, lon, square_size_meters):
     Returns:
         tuple: (GeoDataFrame, geometry, bounds) - all in WGS84
     """
-    # Create point in WGS84
-    point_wgs84 = Point(lon, lat)
+    square_wgs84, bounds = _square_geom(lat, lon, square_size_meters)
     
+    # Create GeoDataFrame
+    gdf = gpd.GeoDataFrame([{'geometry': square_wgs84}], crs="EPSG:4326")
+    
+    return gdf, square_wgs84, bounds
+
+
+def _square_geom(lat, lon, square_size_meters):
+    """Create the geometry of a square AOI around a coordinate point.
+    
+    Args:
+        lat: Latitude in WGS84 (EPSG:4326)
+        lon: Longitude in WGS84 (EPSG:4326)
+        square_size_meters: Side length of square in meters
+        
+    Returns:
+        tuple: (geometry, bounds) - in WGS84
+    """
     # Project to UTM for accurate distance measurements
     # Determine appropriate UTM zone from longitude
     utm_zone = int((lon + 180) / 6) + 1
     hemisphere = 'north' if lat >= 0 else 'south'
     utm_epsg = 32600 + utm_zone if hemisphere == 'north' else 32700 + utm_zone
     
-    # Create transformers
-    wgs84_to_utm = Transformer.from_crs("EPSG:4326", f"EPSG:{utm_epsg}", always_xy=True)
-    utm_to_wgs84 = Transformer.from_crs(f"EPSG:{utm_epsg}", "EPSG:4326", always_xy=True)
+    # Get (cached) transformers
+    wgs84_to_utm, utm_to_wgs84 = _get_transformers(utm_epsg)
     
     # Transform point to UTM
     x_utm, y_utm = wgs84_to_utm.transform(lon, lat)
     
-    # Create square in UTM (centered on point)
+    # Corners of the square in UTM (centered on point), same ring as shapely's box
     half_size = square_size_meters / 2.0
-    minx = x_utm - half_size
-    maxx = x_utm + half_size
-    miny = y_utm - half_size
-    maxy = y_utm + half_size
+    xs = x_utm + half_size * _SQUARE_RING_X
+    ys = y_utm + half_size * _SQUARE_RING_Y
     
-    square_utm = box(minx, miny, maxx, maxy)
-    
-    # Transform back to WGS84
-    # Get coordinates of the square and transform each
-    coords = list(square_utm.exterior.coords)
-    coords_wgs84 = [utm_to_wgs84.transform(x, y) for x, y in coords]
-    
-    # Create polygon in WGS84
-    from shapely.geometry import Polygon
-    square_wgs84 = Polygon(coords_wgs84)
-    
-    # Create GeoDataFrame
-    gdf = gpd.GeoDataFrame([{'geometry': square_wgs84}], crs="EPSG:4326")
+    # Transform all corners back to WGS84 in a single call
+    lons, lats = utm_to_wgs84.transform(xs, ys)
+    square_wgs84 = Polygon(np.column_stack([lons, lats]))
     
-    # Get bounds
-    bounds = square_wgs84.bounds
-    
-    return gdf, square_wgs84, bounds
+    return square_wgs84, square_wgs84.bounds
 
 
 def create_overall_bounding_aoi(coordinates, square_size_meters, buffer_meters=0):
@@ -93,47 +195,62 @@ def create_overall_bounding_aoi(coordinates, square_size_meters, buffer_meters=0
         buffer_meters: Additional buffer around the overall bounds (default: 0)
         
     Returns:
-        tuple: (GeoDataFrame, geometry, bounds) - all in WGS84
+        tuple: (GeoDataFrame, geometry, bounds, utm_area) - all in WGS84
+               except utm_area, the area in m² measured in the UTM zone of the AOI center
     """
     if not coordinates or len(coordinates) == 0:
         raise ValueError("Need at least one coordinate")
     
-    # Create all individual squares and collect their bounds
-    all_bounds = []
-    
-    for lat, lon in coordinates:
-        _, _, bounds = create_square_aoi_from_coordinates(lat, lon, square_size_meters)
-        all_bounds.append(bounds)
+    # Project all points to UTM per zone and offset the square corners there,
+    # instead of building an individual square AOI for every coordinate
+    coords_array = np.asarray(coordinates, dtype=float)
+    lats = coords_array[:, 0]
+    lons = coords_array[:, 1]
     
-    # Find overall min/max in WGS84
-    all_minx = [b[0] for b in all_bounds]
-    all_miny = [b[1] for b in all_bounds]
-    all_maxx = [b[2] for b in all_bounds]
-    all_maxy = [b[3] for b in all_bounds]
+    utm_zones = ((lons + 180) // 6).astype(int) + 1
+    utm_epsgs = np.where(lats >= 0, 32600, 32700) + utm_zones
     
-    overall_minx = min(all_minx)
-    overall_miny = min(all_miny)
-    overall_maxx = max(all_maxx)
-    overall_maxy = max(all_maxy)
+    half_size = square_size_meters / 2.0
+    corner_lons = []
+    corner_lats = []
     
-    # Apply buffer if requested (need to convert to meters)
-    if buffer_meters > 0:
-        # Use UTM for accurate buffering
-        # Determine UTM zone from center point
-        center_lon = (overall_minx + overall_maxx) / 2
-        center_lat = (overall_miny + overall_maxy) / 2
+    for utm_epsg in np.unique(utm_epsgs):
+        in_zone = utm_epsgs == utm_epsg
+        wgs84_to_utm, utm_to_wgs84 = _get_transformers(int(utm_epsg))
         
-        utm_zone = int((center_lon + 180) / 6) + 1
-        hemisphere = 'north' if center_lat >= 0 else 'south'
-        utm_epsg = 32600 + utm_zone if hemisphere == 'north' else 32700 + utm_zone
+        x_utm, y_utm = wgs84_to_utm.transform(lons[in_zone], lats[in_zone])
         
-        # Transform bounds to UTM
-        wgs84_to_utm = Transformer.from_crs("EPSG:4326", f"EPSG:{utm_epsg}", always_xy=True)
-        utm_to_wgs84 = Transformer.from_crs(f"EPSG:{utm_epsg}", "EPSG:4326", always_xy=True)
+        # All four square corners of every point in this zone
+        corners_x = np.concatenate([x_utm - half_size, x_utm - half_size, x_utm + half_size, x_utm + half_size])
+        corners_y = np.concatenate([y_utm - half_size, y_utm + half_size, y_utm - half_size, y_utm + half_size])
         
-        # Transform corners
-        minx_utm, miny_utm = wgs84_to_utm.transform(overall_minx, overall_miny)
-        maxx_utm, maxy_utm = wgs84_to_utm.transform(overall_maxx, overall_maxy)
+        zone_lons, zone_lats = utm_to_wgs84.transform(corners_x, corners_y)
+        corner_lons.append(zone_lons)
+        corner_lats.append(zone_lats)
+    
+    # Find overall min/max in WGS84 over the corners of all squares
+    corner_lons = np.concatenate(corner_lons)
+    corner_lats = np.concatenate(corner_lats)
+    overall_minx, overall_maxx = float(corner_lons.min()), float(corner_lons.max())
+    overall_miny, overall_maxy = float(corner_lats.min()), float(corner_lats.max())
+    
+    # Use UTM for accurate buffering and area calculation
+    # Determine UTM zone from center point
+    center_lon = (overall_minx + overall_maxx) / 2
+    center_lat = (overall_miny + overall_maxy) / 2
+    
+    utm_zone = int((center_lon + 180) / 6) + 1
+    hemisphere = 'north' if center_lat >= 0 else 'south'
+    utm_epsg = 32600 + utm_zone if hemisphere == 'north' else 32700 + utm_zone
+    
+    wgs84_to_utm, utm_to_wgs84 = _get_transformers(utm_epsg)
+    
+    # Apply buffer if requested (need to convert to meters)
+    if buffer_meters > 0:
+        # Transform both corners in a single call
+        (minx_utm, maxx_utm), (miny_utm, maxy_utm) = wgs84_to_utm.transform(
+            [overall_minx, overall_maxx], [overall_miny, overall_maxy]
+        )
         
         # Apply buffer in UTM
         minx_utm -= buffer_meters
@@ -142,8 +259,9 @@ def create_overall_bounding_aoi(coordinates, square_size_meters, buffer_meters=0
         maxy_utm += buffer_meters
         
         # Transform back to WGS84
-        overall_minx, overall_miny = utm_to_wgs84.transform(minx_utm, miny_utm)
-        overall_maxx, overall_maxy = utm_to_wgs84.transform(maxx_utm, maxy_utm)
+        (overall_minx, overall_maxx), (overall_miny, overall_maxy) = utm_to_wgs84.transform(
+            [minx_utm, maxx_utm], [miny_utm, maxy_utm]
+        )
     
     # Create bounding box
     bbox = box(overall_minx, overall_miny, overall_maxx, overall_maxy)
@@ -154,7 +272,11 @@ def create_overall_bounding_aoi(coordinates, square_size_meters, buffer_meters=0
     # Get bounds
     bounds = bbox.bounds
     
-    return gdf, bbox, bounds
+    # Project the box to UTM to get its area in m²
+    xs, ys = wgs84_to_utm.transform(*bbox.exterior.xy)
+    utm_area = Polygon(list(zip(xs, ys))).area
+    
+    return gdf, bbox, bounds, utm_area
 
 
 def check_coverage(aoi_geometry, image_geometry):
@@ -167,11 +289,32 @@ def check_coverage(aoi_geometry, image_geometry):
     Returns:
         tuple: (coverage_percentage, is_fully_covered)
     """
-    if not image_geometry.intersects(aoi_geometry):
-        return 0.0, False
+    coverage_pct, is_covered = check_coverage_many(aoi_geometry, [image_geometry])
+    return float(coverage_pct[0]), bool(is_covered[0])
+
+
+def check_coverage_many(aoi_geometry, image_geometries):
+    """Check the AOI coverage of many image footprints at once.
     
-    intersection = image_geometry.intersection(aoi_geometry)
-    coverage_pct = (intersection.area / aoi_geometry.area) * 100
+    Vectorized version of check_coverage (one GEOS call per step instead
+    of one Python call per footprint).
+    
+    Args:
+        aoi_geometry: Shapely geometry of AOI
+        image_geometries: Sequence of Shapely geometries of image footprints
+        
+    Returns:
+        tuple: (coverage_percentages, is_fully_covered) - numpy arrays
+    """
+    image_geometries = np.asarray(image_geometries, dtype=object)
+    
+    # Footprints usually contain the whole AOI, no intersection needed then
+    contained = shapely.contains(image_geometries, aoi_geometry)
+    coverage_pct = np.full(len(image_geometries), 100.0)
+    
+    partial = ~contained
+    if partial.any():
+        intersections = shapely.intersection(image_geometries[partial], aoi_geometry)
+        coverage_pct[partial] = shapely.area(intersections) / aoi_geometry.area * 100
     
     return coverage_pct, coverage_pct >= 99.9  # Allow small rounding errors
-
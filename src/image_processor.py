@@ -1,17 +1,256 @@
 """Functions for processing and exporting Sentinel-2 images."""
 
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache
 import numpy as np
+import pyproj
 import rasterio
+from rasterio import Affine
+from rasterio.crs import CRS
+from rasterio.transform import array_bounds
+from rasterio.windows import Window
+from rasterio.features import geometry_mask
 from rasterio.mask import mask
-from rasterio.merge import merge
-from rasterio.warp import calculate_default_transform, reproject, Resampling
+from rasterio.warp import reproject, transform_bounds, Resampling
 from PIL import Image
 import planetary_computer
+import pystac
 import time
 from rasterio.errors import RasterioIOError
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional, normalization falls back to NumPy
+    njit = None
 
-def load_and_crop_bands(items, aoi_geometry, bands_config, max_retries=3):
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB, TJSAMP_420
+except ImportError:  # PyTurboJPEG is optional, JPEG export falls back to Pillow
+    TurboJPEG = None
+
+
+# GDAL options for reading Planetary Computer COGs over HTTP: merged range
+# requests and a larger first read on open. The process-wide settings (HTTP/2,
+# no directory listing, caches) are set as environment variables in main.py.
+COG_READ_OPTIONS = {
+    'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+    'GDAL_INGESTED_BYTES_AT_OPEN': '32768'
+}
+
+# GeoTIFF creation options: DEFLATE with horizontal differencing (compression
+# threads come from GDAL_NUM_THREADS)
+GEOTIFF_WRITE_OPTIONS = {
+    'compress': 'deflate',
+    'predictor': 2,
+    'interleave': 'pixel',
+    'BIGTIFF': 'IF_SAFER'
+}
+
+# Internal tiles for chunked reads downstream, only for images larger than
+# one tile (padding small crops to a full tile makes them bigger)
+GEOTIFF_TILE_SIZE = 512
+
+# Working buffer of rasterio.warp.reproject in MB (GDAL default: 64), per
+# parallel date
+WARP_MEM_LIMIT = 256
+
+# Size of the float32 buffer used by normalize_for_display without numba
+_NORMALIZE_BLOCK_BYTES = 1 << 20
+
+# Section rules of the metadata doc
+_DOC_RULE = "=" * 70 + "\n"
+_DOC_SEPARATOR = "-" * 70 + "\n"
+
+
+@lru_cache(maxsize=32)
+def _get_transformer(src_crs, dst_crs):
+    """Get a cached pyproj Transformer, creating one sets up a PROJ pipeline.
+    
+    Args:
+        src_crs: Source CRS string (e.g. 'EPSG:4326')
+        dst_crs: Target CRS string
+        
+    Returns:
+        pyproj.Transformer: Transformer with x/y (lon/lat) axis order
+    """
+    return pyproj.Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+
+
+def _warp_options():
+    """Get the thread and memory options for rasterio.warp.reproject.
+    
+    Threads follow GDAL_NUM_THREADS, which main.py sets to the cores per
+    parallel date, so warps of parallel dates don't oversubscribe the host.
+    
+    Returns:
+        dict: Keyword arguments for reproject
+    """
+    num_threads = os.environ.get('GDAL_NUM_THREADS', '1')
+    if num_threads.upper() == 'ALL_CPUS':
+        num_threads = os.cpu_count() or 1
+    return {'num_threads': max(1, int(num_threads)), 'warp_mem_limit': WARP_MEM_LIMIT}
+
+
+def _cog_read_env():
+    """Create a rasterio environment with the COG read options.
+    
+    Options already set as environment variables (e.g. from config.yaml)
+    take precedence, so nested environments don't conflict.
+    
+    Returns:
+        rasterio.Env: Environment to use as context manager
+    """
+    return rasterio.Env(**{
+        key: os.environ.get(key, value) for key, value in COG_READ_OPTIONS.items()
+    })
+
+
+def process_date(date, items, aoi_geometry, tif_path, jpg_path, config, debug=False, progress=""):
+    """Load, mosaic, crop and export the images of a single date.
+    
+    Runs in a thread or process pool worker, so all inputs are picklable.
+    
+    Args:
+        date: Acquisition date (YYYY-MM-DD)
+        items: STAC items (tiles) of this date, or their dicts from Item.to_dict()
+        aoi_geometry: Shapely geometry of the AOI
+        tif_path: Output GeoTIFF path
+        jpg_path: Output JPEG path
+        config: Configuration dictionary
+        debug: Print data statistics (full passes over the arrays)
+        progress: Progress label printed with the date (e.g. "[2/5]")
+        
+    Returns:
+        dict: Profile of the exported GeoTIFF, or None if the date was skipped or failed
+    """
+    # Rebuild STAC items passed as dicts (asset hrefs are signed when opened)
+    items = [pystac.Item.from_dict(item) if isinstance(item, dict) else item for item in items]
+    
+    print(f"\n{progress} Processing {date}...")
+    print(f"  Tiles to mosaic: {len(items)}")
+    
+    # Calculate average cloud cover
+    avg_cloud = sum(item.properties.get('eo:cloud_cover', 0) for item in items) / len(items)
+    print(f"  Average cloud cover: {avg_cloud:.1f}%")
+    
+    try:
+        # Load, mosaic, and crop bands
+        print(f"  Loading and mosaicking {len(items)} tile(s)...")
+        rgb_array, profile = load_and_crop_bands(
+            items,
+            aoi_geometry,
+            config['bands'],
+            open_workers=config.get('open_workers', 8)
+        )
+        
+        # Debug: Check raw data values
+        if debug:
+            print(f"  DEBUG - Raw data shape: {rgb_array.shape}")
+            print(f"  DEBUG - Raw data type: {rgb_array.dtype}")
+            print(f"  DEBUG - Raw data range: min={rgb_array.min()}, max={rgb_array.max()}")
+            print(f"  DEBUG - Non-zero pixels: {np.count_nonzero(rgb_array)}/{rgb_array.size}")
+        
+        # Check for valid data (a strided probe finds data in typical
+        # images, the full scan only runs when the probe is all zero)
+        if not rgb_array[::64, ::64].any() and not rgb_array.any():
+            print(f"  ⚠ WARNING: {date} - All pixel values are zero! Skipping...")
+            return None
+        
+        # Resample to target resolution
+        print(f"  Checking resolution...")
+        rgb_array, profile = resample_to_resolution(
+            rgb_array,
+            profile,
+            config['output']['target_resolution'],
+            method=config['output'].get('resampling', 'bilinear')
+        )
+        
+        # Print final image info
+        width_m = profile['width'] * config['output']['target_resolution']
+        height_m = profile['height'] * config['output']['target_resolution']
+        print(f"  Final image: {profile['width']} x {profile['height']} pixels")
+        print(f"  Coverage area: {width_m/1000:.2f} x {height_m/1000:.2f} km")
+        
+        # Debug: Check resampled data
+        if debug:
+            # Per-band statistics in one reduction each, overall range derived from them
+            band_mins = rgb_array.min(axis=(0, 1))
+            band_maxs = rgb_array.max(axis=(0, 1))
+            band_means = rgb_array.mean(axis=(0, 1))
+            print(f"  DEBUG - Resampled data range: min={band_mins.min()}, max={band_maxs.max()}")
+            for i, band_name in enumerate(['Red', 'Green', 'Blue']):
+                print(f"  DEBUG - {band_name} band: min={band_mins[i]}, max={band_maxs[i]}, mean={band_means[i]:.2f}")
+        
+        # Export GeoTIFF
+        print(f"  Exporting GeoTIFF...")
+        export_geotiff(rgb_array, profile, tif_path)
+        
+        # Normalize for JPEG display (official Sentinel Hub method)
+        print(f"  Normalizing for display...")
+        rgb_normalized = normalize_for_display(rgb_array)
+        
+        # Debug: Check normalized data
+        if debug:
+            print(f"  DEBUG - Normalized data range: min={rgb_normalized.min()}, max={rgb_normalized.max()}")
+        
+        # Export JPEG
+        print(f"  Exporting JPEG...")
+        export_jpeg(
+            rgb_normalized,
+            jpg_path,
+            quality=config['output']['jpg_quality']
+        )
+        
+        # Profile needs bounds for metadata
+        if 'bounds' not in profile:
+            profile['bounds'] = array_bounds(
+                profile['height'],
+                profile['width'],
+                profile['transform']
+            )
+        
+        print(f"  ✓ Successfully processed {date}!")
+        
+        return profile
+        
+    except Exception as e:
+        print(f"  ✗ Error processing image for {date}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+_open_pool = None
+_open_pool_pid = None
+_open_pool_lock = threading.Lock()
+
+
+def _get_open_pool(max_workers):
+    """Get the long-lived thread pool that opens tiles.
+    
+    GDAL keeps HTTP connections per thread, so opening on the same threads
+    for every date reuses connections instead of setting up new ones.
+    A forked worker process creates its own pool.
+    
+    Args:
+        max_workers: Number of threads, used when the pool is created
+        
+    Returns:
+        ThreadPoolExecutor: Shared pool
+    """
+    global _open_pool, _open_pool_pid
+    with _open_pool_lock:
+        if _open_pool is None or _open_pool_pid != os.getpid():
+            _open_pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tile-open')
+            _open_pool_pid = os.getpid()
+        return _open_pool
+
+
+def load_and_crop_bands(items, aoi_geometry, bands_config, max_retries=3, open_workers=8):
     """Load RGB bands from multiple tiles, mosaic, and crop to AOI.
     
     Args:
@@ -19,164 +258,138 @@ def load_and_crop_bands(items, aoi_geometry, bands_config, max_retries=3):
         aoi_geometry: Shapely geometry of AOI (in WGS84)
         bands_config: Dictionary with 'red', 'green', 'blue' band names
         max_retries: Maximum number of retry attempts for failed reads
+        open_workers: Threads of the shared pool that opens the tiles
         
     Returns:
         tuple: (rgb_array, profile) - RGB array (H, W, 3) and rasterio profile
     """
-    import pyproj
     from shapely.ops import transform
     
+    band_names = ['red', 'green', 'blue']
+    
+    # Open all tiles of all bands concurrently, each open waits on an HTTP round trip
+    band_sources = {band_name: [None] * len(items) for band_name in band_names}
+    executor = _get_open_pool(open_workers)
+    future_to_key = {
+        executor.submit(_open_band, item, bands_config[band_name], band_name, max_retries): (band_name, item_idx)
+        for band_name in band_names
+        for item_idx, item in enumerate(items)
+    }
+    for future in as_completed(future_to_key):
+        if future.exception() is not None:
+            # Don't start the remaining opens
+            for pending in future_to_key:
+                pending.cancel()
+            break
+    
+    # Wait for opens still running, so every opened dataset can be closed
+    wait(future_to_key)
+    
+    # Every open has finished or never started
+    failed = None
+    for future, (band_name, item_idx) in future_to_key.items():
+        if future.cancelled():
+            continue
+        if future.exception() is None:
+            band_sources[band_name][item_idx] = future.result()
+        elif failed is None:
+            failed = future.exception()
+    if failed is not None:
+        _close_band_sources(band_sources)
+        raise failed
+    
     # Process each band separately
     rgb_bands = []
+    aoi_by_crs = {}
     
-    for band_name in ['red', 'green', 'blue']:
-        band_key = bands_config[band_name]
-        
-        # Open all tiles for this band with retry logic
-        src_files = []
-        for item in items:
-            band_href = planetary_computer.sign(item.assets[band_key].href)
-            
-            # Try to open with retries
-            for attempt in range(max_retries):
-                try:
-                    src = rasterio.open(band_href)
-                    src_files.append(src)
-                    break
-                except Exception as e:
-                    if attempt < max_retries - 1:
-                        print(f"    Retry {attempt + 1}/{max_retries} for {band_name} band...")
-                        time.sleep(2)  # Wait before retry
-                    else:
-                        raise Exception(f"Failed to open {band_name} band after {max_retries} attempts: {str(e)}")
-        
-        # Determine target CRS from first source
-        target_crs = src_files[0].crs
-        
-        # Reproject AOI geometry to target CRS
-        project = pyproj.Transformer.from_crs(
-            "EPSG:4326",  # WGS84 (AOI is in this CRS)
-            target_crs,
-            always_xy=True
-        ).transform
-        aoi_reprojected = transform(project, aoi_geometry)
-        
-        # Mosaic tiles if multiple, otherwise use single tile
-        if len(src_files) > 1:
-            # Check for CRS mismatch and reproject if needed
-            crs_mismatch = any(src.crs != target_crs for src in src_files)
-            
-            if crs_mismatch:
-                print(f"    Reprojecting tiles to common CRS: {target_crs}")
-                # Reproject all files to the first file's CRS
-                from rasterio.io import MemoryFile
-                reprojected_files = []
+    # Tile reads (mask/windowed reads/reproject) run with the COG read options,
+    # datasets left open by a failure are closed in the end
+    try:
+        with _cog_read_env():
+            for band_name in band_names:
+                band_key = bands_config[band_name]
+                src_files = band_sources[band_name]
+                
+                # Determine target CRS from first source
+                target_crs = src_files[0].crs
                 
-                for src_idx, src in enumerate(src_files):
-                    if src.crs != target_crs:
-                        # Calculate transform for reprojection
-                        transform_calc, width, height = calculate_default_transform(
-                            src.crs, target_crs, src.width, src.height, *src.bounds
-                        )
-                        
-                        # Create in-memory reprojected dataset
-                        memfile = MemoryFile()
-                        reproj_profile = src.profile.copy()
-                        reproj_profile.update({
-                            'crs': target_crs,
-                            'transform': transform_calc,
-                            'width': width,
-                            'height': height
-                        })
-                        
-                        mem_dataset = memfile.open(**reproj_profile)
-                        
-                        # Reproject with retry logic
-                        reprojection_success = False
-                        for attempt in range(max_retries):
-                            try:
-                                reproject(
-                                    source=rasterio.band(src, 1),
-                                    destination=rasterio.band(mem_dataset, 1),
-                                    src_transform=src.transform,
-                                    src_crs=src.crs,
-                                    dst_transform=transform_calc,
-                                    dst_crs=target_crs,
-                                    resampling=Resampling.bilinear
-                                )
-                                reprojection_success = True
-                                break
-                            except Exception as e:
-                                if attempt < max_retries - 1:
-                                    print(f"      Retry {attempt + 1}/{max_retries} for reprojection...")
-                                    time.sleep(3)
-                                    # Re-sign and re-open the source
+                # Reproject AOI geometry to target CRS (once, all bands share the tile CRS)
+                crs_key = str(target_crs)
+                if crs_key not in aoi_by_crs:
+                    # AOI is in WGS84
+                    project = _get_transformer("EPSG:4326", crs_key).transform
+                    aoi_by_crs[crs_key] = transform(project, aoi_geometry)
+                aoi_reprojected = aoi_by_crs[crs_key]
+                
+                # Mosaic tiles if multiple, otherwise use single tile
+                if len(src_files) > 1:
+                    # Mosaic only the AOI window of each tile, tiles in another
+                    # CRS are reprojected straight onto the mosaic grid
+                    if any(src.crs != target_crs for src in src_files):
+                        print(f"    Reprojecting tiles to common CRS: {target_crs}")
+                    
+                    # Mosaic with retry logic
+                    for attempt in range(max_retries):
+                        try:
+                            mosaic_array, mosaic_transform = _read_window_mosaic(src_files, aoi_reprojected)
+                            break
+                        except ValueError:
+                            # AOI doesn't overlap the tiles, retrying can't help
+                            raise
+                        except Exception as e:
+                            if attempt < max_retries - 1:
+                                print(f"      Retry {attempt + 1}/{max_retries} for mosaicking {band_name} band...")
+                                time.sleep(3)
+                                # Re-sign and re-open the sources
+                                for src in src_files:
+                                    src.close()
+                                src_files = band_sources[band_name] = []
+                                for item in items:
+                                    src_files.append(rasterio.open(_sign_asset(item, band_key)))
+                            else:
+                                print(f"      Failed to mosaic after {max_retries} attempts: {str(e)}")
+                                raise
+                    
+                    profile = src_files[0].profile.copy()
+                    profile['crs'] = target_crs
+                    
+                    # Crop mosaic array to AOI directly (using reprojected geometry)
+                    cropped, out_transform = _crop_to_geometry(
+                        mosaic_array,
+                        mosaic_transform,
+                        aoi_reprojected,
+                        nodata=profile.get('nodata')
+                    )
+                else:
+                    # Single tile - just crop (using reprojected geometry) with retry logic
+                    for attempt in range(max_retries):
+                        try:
+                            cropped, out_transform = mask(src_files[0], [aoi_reprojected], crop=True)
+                            break
+                        except (RasterioIOError, Exception) as e:
+                            if attempt < max_retries - 1:
+                                print(f"    Retry {attempt + 1}/{max_retries} for cropping {band_name} band...")
+                                time.sleep(3)  # Wait longer before retry
+                                # Re-sign and re-open the URL
+                                for src in src_files:
                                     src.close()
-                                    band_href = planetary_computer.sign(items[src_idx].assets[band_key].href)
-                                    src = rasterio.open(band_href)
-                                    src_files[src_idx] = src
-                                else:
-                                    print(f"      Failed to reproject after {max_retries} attempts: {str(e)}")
-                                    raise
-                        
-                        reprojected_files.append(mem_dataset)
-                    else:
-                        reprojected_files.append(src)
+                                src_files = band_sources[band_name] = []
+                                for item in items:
+                                    band_href = _sign_asset(item, band_key)
+                                    src_files.append(rasterio.open(band_href))
+                            else:
+                                raise Exception(f"Failed to crop {band_name} band after {max_retries} attempts: {str(e)}")
+                    
+                    profile = src_files[0].profile.copy()
                 
-                # Merge reprojected files
-                mosaic_array, mosaic_transform = merge(reprojected_files)
+                # Close all source files
+                for src in src_files:
+                    src.close()
+                band_sources[band_name] = []
                 
-                # Close memory files
-                for rf in reprojected_files:
-                    if rf not in src_files:
-                        rf.close()
-            else:
-                # All same CRS, merge directly
-                mosaic_array, mosaic_transform = merge(src_files)
-            
-            # Create in-memory dataset for the mosaic
-            profile = src_files[0].profile.copy()
-            profile.update({
-                'crs': target_crs,
-                'height': mosaic_array.shape[1],
-                'width': mosaic_array.shape[2],
-                'transform': mosaic_transform
-            })
-            
-            # Use rasterio MemoryFile to create temporary dataset
-            from rasterio.io import MemoryFile
-            with MemoryFile() as memfile:
-                with memfile.open(**profile) as mem_dataset:
-                    mem_dataset.write(mosaic_array)
-                    # Crop to AOI (using reprojected geometry)
-                    cropped, out_transform = mask(mem_dataset, [aoi_reprojected], crop=True)
-        else:
-            # Single tile - just crop (using reprojected geometry) with retry logic
-            for attempt in range(max_retries):
-                try:
-                    cropped, out_transform = mask(src_files[0], [aoi_reprojected], crop=True)
-                    break
-                except (RasterioIOError, Exception) as e:
-                    if attempt < max_retries - 1:
-                        print(f"    Retry {attempt + 1}/{max_retries} for cropping {band_name} band...")
-                        time.sleep(3)  # Wait longer before retry
-                        # Re-sign and re-open the URL
-                        for src in src_files:
-                            src.close()
-                        src_files = []
-                        for item in items:
-                            band_href = planetary_computer.sign(item.assets[band_key].href)
-                            src_files.append(rasterio.open(band_href))
-                    else:
-                        raise Exception(f"Failed to crop {band_name} band after {max_retries} attempts: {str(e)}")
-            
-            profile = src_files[0].profile.copy()
-        
-        # Close all source files
-        for src in src_files:
-            src.close()
-        
-        rgb_bands.append(cropped[0])
+                rgb_bands.append(cropped[0])
+    finally:
+        _close_band_sources(band_sources)
     
     # Stack bands
     rgb = np.stack(rgb_bands, axis=-1)
@@ -187,20 +400,197 @@ def load_and_crop_bands(items, aoi_geometry, bands_config, max_retries=3):
         'count': 3,
         'height': rgb.shape[0],
         'width': rgb.shape[1],
-        'transform': out_transform,
-        'compress': 'lzw'
+        'transform': out_transform
     })
     
     return rgb, profile
 
 
-def resample_to_resolution(rgb_array, profile, target_resolution):
+def _close_band_sources(band_sources):
+    """Close all datasets still open in a {band_name: [dataset, ...]} mapping."""
+    for src_files in band_sources.values():
+        for src in src_files:
+            if src is not None:
+                src.close()
+
+
+def _read_window_mosaic(src_files, geometry):
+    """Mosaic the window covering a geometry from tiles on the grid of the first tile.
+    
+    Only the pixels inside the geometry bounds are read from each COG,
+    instead of the full tiles read by rasterio.merge. Tiles in another CRS
+    are reprojected directly into an array on the mosaic grid. Like merge,
+    the first tile with valid data wins where tiles overlap.
+    
+    Args:
+        src_files: Open datasets with the same resolution
+        geometry: Shapely geometry in the CRS of the datasets
+        
+    Returns:
+        tuple: (mosaic_array, mosaic_transform) - array (1, H, W) on the grid of the first tile
+    """
+    first = src_files[0]
+    nodata = 0 if first.nodata is None else first.nodata
+    
+    # Geometry bounds limited to the tile coverage, as merge + mask would give
+    tile_bounds = np.array([
+        src.bounds if src.crs == first.crs else transform_bounds(src.crs, first.crs, *src.bounds)
+        for src in src_files
+    ])
+    minx, miny, maxx, maxy = geometry.bounds
+    minx = max(minx, tile_bounds[:, 0].min())
+    miny = max(miny, tile_bounds[:, 1].min())
+    maxx = min(maxx, tile_bounds[:, 2].max())
+    maxy = min(maxy, tile_bounds[:, 3].max())
+    
+    # Snap the window to the pixel grid of the first tile
+    inverse = ~first.transform
+    col_start, row_start = inverse * (minx, maxy)
+    col_stop, row_stop = inverse * (maxx, miny)
+    col_start, row_start = math.floor(col_start), math.floor(row_start)
+    width = max(math.ceil(col_stop) - col_start, 0)
+    height = max(math.ceil(row_stop) - row_start, 0)
+    if width == 0 or height == 0:
+        raise ValueError("Input shapes do not overlap raster.")
+    mosaic_transform = first.transform * Affine.translation(col_start, row_start)
+    
+    # Preallocated canvas, each tile is pasted into the part it overlaps
+    mosaic = np.full((height, width), nodata, dtype=first.dtypes[0])
+    for src in src_files:
+        if src.crs != first.crs:
+            # Warp the tile straight into an array on the mosaic grid
+            tile = np.full((height, width), nodata, dtype=first.dtypes[0])
+            reproject(
+                source=rasterio.band(src, 1),
+                destination=tile,
+                src_transform=src.transform,
+                src_crs=src.crs,
+                src_nodata=src.nodata,
+                dst_transform=mosaic_transform,
+                dst_crs=first.crs,
+                dst_nodata=nodata,
+                resampling=Resampling.bilinear,
+                **_warp_options()
+            )
+            region = mosaic
+        else:
+            # Offset of the mosaic in the pixel grid of this tile
+            col_off, row_off = ~src.transform * (mosaic_transform.c, mosaic_transform.f)
+            col_off, row_off = round(col_off), round(row_off)
+            
+            # Part of the mosaic inside this tile
+            col_start, row_start = max(-col_off, 0), max(-row_off, 0)
+            col_stop = min(src.width - col_off, width)
+            row_stop = min(src.height - row_off, height)
+            if col_stop <= col_start or row_stop <= row_start:
+                continue
+            
+            window = Window(
+                col_off + col_start, row_off + row_start,
+                col_stop - col_start, row_stop - row_start
+            )
+            tile = src.read(1, window=window)
+            region = mosaic[row_start:row_stop, col_start:col_stop]
+        
+        # First valid pixel wins
+        np.copyto(region, tile, where=region == nodata)
+    
+    return mosaic[np.newaxis], mosaic_transform
+
+
+def _crop_to_geometry(array, array_transform, geometry, nodata=None):
+    """Crop an in-memory raster array to a geometry.
+    
+    Same result as rasterio.mask.mask with crop=True, without writing the
+    array to a dataset first.
+    
+    Args:
+        array: Raster array (bands, H, W)
+        array_transform: Affine transform of the array
+        geometry: Shapely geometry in the CRS of the array
+        nodata: Value for pixels outside the geometry (default: 0)
+        
+    Returns:
+        tuple: (cropped_array, cropped_transform)
+    """
+    minx, miny, maxx, maxy = geometry.bounds
+    inverse = ~array_transform
+    col_start, row_start = inverse * (minx, maxy)
+    col_stop, row_stop = inverse * (maxx, miny)
+    
+    # Pixel window covering the geometry bounds, limited to the array
+    row_start = max(int(math.floor(row_start)), 0)
+    col_start = max(int(math.floor(col_start)), 0)
+    row_stop = min(int(math.ceil(row_stop)), array.shape[1])
+    col_stop = min(int(math.ceil(col_stop)), array.shape[2])
+    
+    if row_stop <= row_start or col_stop <= col_start:
+        raise ValueError("Input shapes do not overlap raster.")
+    
+    cropped = array[:, row_start:row_stop, col_start:col_stop].copy()
+    cropped_transform = array_transform * Affine.translation(col_start, row_start)
+    
+    # Set pixels outside the geometry (non-rectangular AOIs) to nodata
+    outside = geometry_mask([geometry], out_shape=cropped.shape[1:], transform=cropped_transform)
+    cropped[:, outside] = 0 if nodata is None else nodata
+    
+    return cropped, cropped_transform
+
+
+def _open_band(item, band_key, band_name, max_retries):
+    """Open one band of a STAC item with retry logic.
+    
+    Args:
+        item: STAC item (tile)
+        band_key: Asset key of the band (e.g. 'B04')
+        band_name: Band name for messages (e.g. 'red')
+        max_retries: Maximum number of retry attempts for failed opens
+        
+    Returns:
+        rasterio.DatasetReader: Opened band
+    """
+    band_href = _sign_asset(item, band_key)
+    
+    for attempt in range(max_retries):
+        try:
+            with _cog_read_env():
+                return rasterio.open(band_href)
+        except Exception as e:
+            if attempt < max_retries - 1:
+                print(f"    Retry {attempt + 1}/{max_retries} for {band_name} band...")
+                time.sleep(2)  # Wait before retry
+                # Sign again in case the token expired
+                band_href = _sign_asset(item, band_key)
+            else:
+                raise Exception(f"Failed to open {band_name} band after {max_retries} attempts: {str(e)}")
+
+
+def _sign_asset(item, band_key):
+    """Get the signed href of a band asset.
+    
+    Tokens come from planetary_computer's token cache, which renews them
+    before they expire, so signing again is cheap and never stale.
+    
+    Args:
+        item: STAC item (tile)
+        band_key: Asset key of the band (e.g. 'B04')
+        
+    Returns:
+        str: Signed href
+    """
+    # Strip the token of an already signed item, sign() would keep it as is
+    href = item.assets[band_key].href.split('?')[0]
+    return planetary_computer.sign(href)
+
+
+def resample_to_resolution(rgb_array, profile, target_resolution, method='bilinear'):
     """Resample RGB array to target resolution.
     
     Args:
         rgb_array: RGB array (H, W, 3)
         profile: Rasterio profile with current transform
         target_resolution: Target resolution in meters/pixel
+        method: 'bilinear' or 'nearest' (faster, used for downsampling only)
         
     Returns:
         tuple: (resampled_rgb_array, updated_profile)
@@ -228,20 +618,29 @@ def resample_to_resolution(rgb_array, profile, target_resolution):
         transform.d, -target_resolution, transform.f
     )
     
-    # Prepare output array
-    resampled_rgb = np.zeros((new_height, new_width, 3), dtype=rgb_array.dtype)
-    
-    # Resample each band
-    for i in range(3):
-        reproject(
-            source=rgb_array[:, :, i],
-            destination=resampled_rgb[:, :, i],
-            src_transform=transform,
-            src_crs=profile['crs'],
-            dst_transform=new_transform,
-            dst_crs=profile['crs'],
-            resampling=Resampling.bilinear
-        )
+    # Nearest neighbor only when downsampling, upsampling stays bilinear
+    if method == 'nearest' and target_resolution > current_resolution:
+        resampling = Resampling.nearest
+    else:
+        resampling = Resampling.bilinear
+    
+    # Resample all bands in one call, rasterio expects (bands, H, W)
+    source = np.ascontiguousarray(rgb_array.transpose(2, 0, 1))
+    destination = np.zeros((3, new_height, new_width), dtype=rgb_array.dtype)
+    
+    reproject(
+        source=source,
+        destination=destination,
+        src_transform=transform,
+        src_crs=profile['crs'],
+        dst_transform=new_transform,
+        dst_crs=profile['crs'],
+        resampling=resampling,
+        **_warp_options()
+    )
+    
+    # Back to (H, W, 3)
+    resampled_rgb = destination.transpose(1, 2, 0)
     
     # Update profile
     updated_profile = profile.copy()
@@ -273,22 +672,55 @@ def normalize_for_display(rgb_array, gain=2.5):
     Returns:
         numpy.ndarray: Normalized RGB array (H, W, 3) with values 0-255 uint8
     """
-    rgb_normalized = np.zeros_like(rgb_array, dtype=np.uint8)
+    # Convert to reflectance (0-1 range), apply gain and scale to 8-bit in one step
+    # Sentinel-2 L2A reflectance values are scaled by 10000
+    scale = np.float32(gain * 255.0 / 10000.0)
     
-    for i in range(3):
-        band = rgb_array[:, :, i].astype(float)
-        
-        # Convert to reflectance (0-1 range) and apply gain
-        # Sentinel-2 L2A reflectance values are scaled by 10000
-        reflectance = (band / 10000.0) * gain
+    if _normalize_kernel is not None:
+        # Single pass over the array with numba
+        rgb_normalized = np.empty(rgb_array.shape, dtype=np.uint8)
+        _normalize_kernel(rgb_array, rgb_normalized, scale)
+        return rgb_normalized
+    
+    # Row blocks through one preallocated float32 buffer small enough to
+    # stay in cache, instead of a full-size float intermediate
+    rgb_normalized = np.empty(rgb_array.shape, dtype=np.uint8)
+    rows_per_block = max(1, _NORMALIZE_BLOCK_BYTES // (math.prod(rgb_array.shape[1:]) * 4 or 1))
+    buffer = np.empty((rows_per_block,) + rgb_array.shape[1:], dtype=np.float32)
+    
+    for row in range(0, rgb_array.shape[0], rows_per_block):
+        block = rgb_array[row:row + rows_per_block]
+        block_buffer = buffer[:block.shape[0]]
+        np.multiply(block, scale, out=block_buffer, dtype=np.float32)
         
-        # Clip to valid range and convert to 8-bit
-        reflectance_clipped = np.clip(reflectance, 0, 1)
-        rgb_normalized[:, :, i] = (reflectance_clipped * 255).astype(np.uint8)
+        # Clip to valid range (in place) and convert to 8-bit
+        np.clip(block_buffer, 0, 255, out=block_buffer)
+        rgb_normalized[row:row + rows_per_block] = block_buffer
     
     return rgb_normalized
 
 
+if njit is not None:
+    # Serial on purpose: dates already run in parallel threads/processes, and
+    # numba's parallel threading layers are not safe under concurrent
+    # launches (workqueue) or fork (OpenMP)
+    @njit(fastmath=True, cache=True)
+    def _normalize_kernel(rgb, out, scale):
+        """Scale, clip and convert an (H, W, 3) array to uint8 in one pass."""
+        for i in range(rgb.shape[0]):
+            for j in range(rgb.shape[1]):
+                for k in range(rgb.shape[2]):
+                    # float32 like the NumPy path (uint16 * float32 is float64 in numba)
+                    v = np.float32(rgb[i, j, k]) * scale
+                    if v < 0.0:
+                        v = 0.0
+                    elif v > 255.0:
+                        v = 255.0
+                    out[i, j, k] = np.uint8(v)
+else:
+    _normalize_kernel = None
+
+
 def export_geotiff(rgb_array, profile, output_path):
     """Export RGB array as GeoTIFF.
     
@@ -297,9 +729,24 @@ def export_geotiff(rgb_array, profile, output_path):
         profile: Rasterio profile
         output_path: Output file path
     """
-    with rasterio.open(output_path, 'w', **profile) as dst:
-        for i in range(3):
-            dst.write(rgb_array[:, :, i], i + 1)
+    write_profile = {**profile, **GEOTIFF_WRITE_OPTIONS}
+    if max(profile['width'], profile['height']) > GEOTIFF_TILE_SIZE:
+        write_profile.update({
+            'tiled': True,
+            'blockxsize': GEOTIFF_TILE_SIZE,
+            'blockysize': GEOTIFF_TILE_SIZE
+        })
+    else:
+        # Striped, also when the source profile was tiled
+        for key in ('tiled', 'blockxsize', 'blockysize'):
+            write_profile.pop(key, None)
+    
+    with rasterio.open(output_path, 'w', **write_profile) as dst:
+        # All bands in one write (band-first, free for resampled arrays)
+        dst.write(np.ascontiguousarray(rgb_array.transpose(2, 0, 1)))
+    
+    # Keep georeferencing next to the TIF so it needn't be reopened for metadata
+    write_profile_sidecar(profile, output_path)
     
     print(f"Saved GeoTIFF: {output_path}")
 
@@ -312,12 +759,99 @@ def export_jpeg(rgb_array, output_path, quality=95):
         output_path: Output file path
         quality: JPEG quality (0-100)
     """
-    img = Image.fromarray(rgb_array)
-    img.save(output_path, 'JPEG', quality=quality)
+    # Normalized arrays are already contiguous, then this is no copy
+    rgb_array = np.ascontiguousarray(rgb_array)
+    
+    jpeg = _get_turbojpeg()
+    if jpeg is not None:
+        # Same 4:2:0 chroma subsampling Pillow uses at these qualities
+        encoded = jpeg.encode(
+            rgb_array,
+            quality=quality,
+            pixel_format=TJPF_RGB,
+            jpeg_subsample=TJSAMP_420
+        )
+        with open(output_path, 'wb') as f:
+            f.write(encoded)
+    else:
+        img = Image.fromarray(rgb_array)
+        img.save(output_path, 'JPEG', quality=quality)
     
     print(f"Saved JPEG: {output_path}")
 
 
+_turbojpeg = None
+
+
+def _get_turbojpeg():
+    """Get a shared libjpeg-turbo encoder.
+    
+    Returns:
+        TurboJPEG: Encoder, or None if PyTurboJPEG or libturbojpeg is not available
+    """
+    global _turbojpeg
+    if _turbojpeg is None and TurboJPEG is not None:
+        try:
+            _turbojpeg = TurboJPEG()
+        except (OSError, RuntimeError):  # Python package without the native library
+            _turbojpeg = False
+    return _turbojpeg or None
+
+
+def write_profile_sidecar(profile, tif_path):
+    """Write the georeferencing of a GeoTIFF to a small JSON sidecar file.
+    
+    Allows regenerating metadata later without reopening the GeoTIFF.
+    
+    Args:
+        profile: Rasterio profile with CRS and transform
+        tif_path: Path of the GeoTIFF the profile belongs to
+    """
+    bounds = profile.get('bounds')
+    if bounds is None:
+        bounds = array_bounds(profile['height'], profile['width'], profile['transform'])
+    
+    sidecar = {
+        'crs': profile['crs'].to_wkt(),
+        'transform': list(profile['transform'])[:6],
+        'width': profile['width'],
+        'height': profile['height'],
+        'count': profile['count'],
+        'dtype': str(profile['dtype']),
+        'bounds': list(bounds)
+    }
+    
+    with open(_profile_sidecar_path(tif_path), 'w') as f:
+        json.dump(sidecar, f)
+
+
+def read_profile_sidecar(tif_path):
+    """Read the profile sidecar written by write_profile_sidecar.
+    
+    Args:
+        tif_path: Path of the GeoTIFF the profile belongs to
+        
+    Returns:
+        dict: Profile with CRS, transform and bounds, or None if no valid sidecar exists
+    """
+    try:
+        with open(_profile_sidecar_path(tif_path)) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    profile['crs'] = CRS.from_wkt(profile['crs'])
+    profile['transform'] = Affine(*profile['transform'])
+    profile['bounds'] = tuple(profile['bounds'])
+    
+    return profile
+
+
+def _profile_sidecar_path(tif_path):
+    """Get the path of the profile sidecar for a GeoTIFF."""
+    return os.path.splitext(tif_path)[0] + '.profile.json'
+
+
 def crop_from_existing_tif(source_tif_path, aoi_geometry, target_resolution=10):
     """Crop a region from an existing TIF file.
     
@@ -331,17 +865,13 @@ def crop_from_existing_tif(source_tif_path, aoi_geometry, target_resolution=10):
     """
     import rasterio
     from rasterio.mask import mask
-    import pyproj
     from shapely.ops import transform
     
     with rasterio.open(source_tif_path) as src:
         # Reproject AOI geometry to match source CRS
         if src.crs.to_epsg() != 4326:
-            project = pyproj.Transformer.from_crs(
-                "EPSG:4326",  # WGS84 (AOI is in this CRS)
-                src.crs,
-                always_xy=True
-            ).transform
+            # AOI is in WGS84
+            project = _get_transformer("EPSG:4326", str(src.crs)).transform
             aoi_reprojected = transform(project, aoi_geometry)
         else:
             aoi_reprojected = aoi_geometry
@@ -374,123 +904,126 @@ def write_metadata_doc(output_dir, location_name, date, items, profile, config):
         profile: Rasterio profile with CRS and transform info
         config: Configuration dictionary
     """
-    import os
     from datetime import datetime
     
     doc_path = os.path.join(output_dir, 'doc.txt')
     
+    # Build the document in memory and write it in one call
+    parts = []
+    parts.append(_DOC_RULE)
+    parts.append("SENTINEL-2 TRUE COLOR IMAGE METADATA\n")
+    parts.append(_DOC_RULE + "\n")
+    
+    # Basic Information
+    parts.append(f"Location: {location_name}\n")
+    parts.append(f"Acquisition Date: {date}\n")
+    parts.append(f"Processing Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    parts.append(f"Number of Tiles: {len(items)}\n\n")
+    
+    # Projection Information
+    parts.append(_DOC_SEPARATOR)
+    parts.append("PROJECTION & COORDINATE SYSTEM\n")
+    parts.append(_DOC_SEPARATOR)
+    crs_epsg = profile['crs'].to_epsg() or "N/A"
+    parts.append(f"Projection: {profile['crs']}\n")
+    parts.append(f"EPSG Code: {crs_epsg}\n")
+    parts.append(f"Linear Units: {profile['crs'].linear_units}\n\n")
+    
+    # Image Properties
+    parts.append(_DOC_SEPARATOR)
+    parts.append("IMAGE PROPERTIES\n")
+    parts.append(_DOC_SEPARATOR)
+    parts.append(f"Width: {profile['width']} pixels\n")
+    parts.append(f"Height: {profile['height']} pixels\n")
+    parts.append(f"Resolution: {config['output']['target_resolution']}m/pixel\n")
+    parts.append(f"Bands: RGB (Red: B04, Green: B03, Blue: B02)\n")
+    parts.append(f"Data Type: {profile['dtype']}\n\n")
+    
+    # Coverage Area
+    width_m = profile['width'] * config['output']['target_resolution']
+    height_m = profile['height'] * config['output']['target_resolution']
+    area_km2 = (width_m * height_m) / 1_000_000
+    parts.append(f"Coverage: {width_m/1000:.3f} km × {height_m/1000:.3f} km\n")
+    parts.append(f"Total Area: {area_km2:.3f} km²\n\n")
+    
+    # Geotransform
+    transform = profile['transform']
+    parts.append(_DOC_SEPARATOR)
+    parts.append("GEOTRANSFORM\n")
+    parts.append(_DOC_SEPARATOR)
+    parts.append(f"Origin X: {transform.c:.2f}\n")
+    parts.append(f"Origin Y: {transform.f:.2f}\n")
+    parts.append(f"Pixel Width: {transform.a:.2f}\n")
+    parts.append(f"Pixel Height: {-transform.e:.2f}\n")
+    parts.append(f"Rotation: {transform.b:.2f}, {transform.d:.2f}\n\n")
+    
+    # Bounds
+    bounds = profile.get('bounds')
+    if bounds:
+        parts.append(f"Bounds:\n")
+        parts.append(f"  West: {bounds[0]:.2f}\n")
+        parts.append(f"  South: {bounds[1]:.2f}\n")
+        parts.append(f"  East: {bounds[2]:.2f}\n")
+        parts.append(f"  North: {bounds[3]:.2f}\n\n")
+    
+    # Sentinel-2 Tile Information
+    parts.append(_DOC_SEPARATOR)
+    parts.append("SENTINEL-2 TILE INFORMATION\n")
+    parts.append(_DOC_SEPARATOR)
+    
+    for idx, item in enumerate(items, 1):
+        parts.append(f"\nTile {idx}:\n")
+        
+        # Product ID
+        product_id = item.id
+        parts.append(f"  Product ID: {product_id}\n")
+        
+        # Datetime
+        item_datetime = item.properties.get('datetime', 'N/A')
+        parts.append(f"  Acquisition Time: {item_datetime}\n")
+        
+        # Platform
+        platform = item.properties.get('platform', 'N/A')
+        parts.append(f"  Satellite: {platform.upper() if platform != 'N/A' else 'N/A'}\n")
+        
+        # Orbit properties
+        orbit_state = item.properties.get('sat:orbit_state', 'N/A')
+        relative_orbit = item.properties.get('sat:relative_orbit', 'N/A')
+        parts.append(f"  Orbit Direction: {orbit_state}\n")
+        parts.append(f"  Relative Orbit: {relative_orbit}\n")
+        
+        # Cloud cover
+        cloud_cover = item.properties.get('eo:cloud_cover', 'N/A')
+        if cloud_cover != 'N/A':
+            parts.append(f"  Cloud Cover: {cloud_cover:.2f}%\n")
+        else:
+            parts.append(f"  Cloud Cover: N/A\n")
+        
+        # Processing level
+        processing_level = item.properties.get('s2:processing_baseline', 'N/A')
+        parts.append(f"  Processing Baseline: {processing_level}\n")
+        
+        # MGRS tile
+        mgrs_tile = item.properties.get('s2:mgrs_tile', 'N/A')
+        parts.append(f"  MGRS Tile: {mgrs_tile}\n")
+    
+    # Processing Information
+    parts.append("\n" + _DOC_SEPARATOR)
+    parts.append("PROCESSING INFORMATION\n")
+    parts.append(_DOC_SEPARATOR)
+    parts.append(f"Normalization Method: Official Sentinel Hub (linear gain)\n")
+    parts.append(f"Gain Factor: 2.5\n")
+    parts.append(f"Compression (GeoTIFF): DEFLATE (predictor 2)\n")
+    parts.append(f"JPEG Quality: {config['output']['jpg_quality']}\n")
+    parts.append(f"Max Cloud Cover Filter: {config['sentinel2']['max_cloud_cover']}%\n")
+    parts.append(f"Min AOI Coverage: {config['sentinel2']['min_aoi_coverage']}%\n\n")
+    
+    parts.append(_DOC_RULE)
+    parts.append("End of Metadata\n")
+    parts.append(_DOC_RULE)
+    
     with open(doc_path, 'w') as f:
-        f.write("=" * 70 + "\n")
-        f.write("SENTINEL-2 TRUE COLOR IMAGE METADATA\n")
-        f.write("=" * 70 + "\n\n")
-        
-        # Basic Information
-        f.write(f"Location: {location_name}\n")
-        f.write(f"Acquisition Date: {date}\n")
-        f.write(f"Processing Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"Number of Tiles: {len(items)}\n\n")
-        
-        # Projection Information
-        f.write("-" * 70 + "\n")
-        f.write("PROJECTION & COORDINATE SYSTEM\n")
-        f.write("-" * 70 + "\n")
-        crs_epsg = profile['crs'].to_epsg() if profile['crs'].to_epsg() else "N/A"
-        f.write(f"Projection: {profile['crs']}\n")
-        f.write(f"EPSG Code: {crs_epsg}\n")
-        f.write(f"Linear Units: {profile['crs'].linear_units}\n\n")
-        
-        # Image Properties
-        f.write("-" * 70 + "\n")
-        f.write("IMAGE PROPERTIES\n")
-        f.write("-" * 70 + "\n")
-        f.write(f"Width: {profile['width']} pixels\n")
-        f.write(f"Height: {profile['height']} pixels\n")
-        f.write(f"Resolution: {config['output']['target_resolution']}m/pixel\n")
-        f.write(f"Bands: RGB (Red: B04, Green: B03, Blue: B02)\n")
-        f.write(f"Data Type: {profile['dtype']}\n\n")
-        
-        # Coverage Area
-        width_m = profile['width'] * config['output']['target_resolution']
-        height_m = profile['height'] * config['output']['target_resolution']
-        area_km2 = (width_m * height_m) / 1_000_000
-        f.write(f"Coverage: {width_m/1000:.3f} km × {height_m/1000:.3f} km\n")
-        f.write(f"Total Area: {area_km2:.3f} km²\n\n")
-        
-        # Geotransform
-        transform = profile['transform']
-        f.write("-" * 70 + "\n")
-        f.write("GEOTRANSFORM\n")
-        f.write("-" * 70 + "\n")
-        f.write(f"Origin X: {transform.c:.2f}\n")
-        f.write(f"Origin Y: {transform.f:.2f}\n")
-        f.write(f"Pixel Width: {transform.a:.2f}\n")
-        f.write(f"Pixel Height: {-transform.e:.2f}\n")
-        f.write(f"Rotation: {transform.b:.2f}, {transform.d:.2f}\n\n")
-        
-        # Bounds
-        bounds = profile.get('bounds')
-        if bounds:
-            f.write(f"Bounds:\n")
-            f.write(f"  West: {bounds[0]:.2f}\n")
-            f.write(f"  South: {bounds[1]:.2f}\n")
-            f.write(f"  East: {bounds[2]:.2f}\n")
-            f.write(f"  North: {bounds[3]:.2f}\n\n")
-        
-        # Sentinel-2 Tile Information
-        f.write("-" * 70 + "\n")
-        f.write("SENTINEL-2 TILE INFORMATION\n")
-        f.write("-" * 70 + "\n")
-        
-        for idx, item in enumerate(items, 1):
-            f.write(f"\nTile {idx}:\n")
-            
-            # Product ID
-            product_id = item.id
-            f.write(f"  Product ID: {product_id}\n")
-            
-            # Datetime
-            item_datetime = item.properties.get('datetime', 'N/A')
-            f.write(f"  Acquisition Time: {item_datetime}\n")
-            
-            # Platform
-            platform = item.properties.get('platform', 'N/A')
-            f.write(f"  Satellite: {platform.upper() if platform != 'N/A' else 'N/A'}\n")
-            
-            # Orbit properties
-            orbit_state = item.properties.get('sat:orbit_state', 'N/A')
-            relative_orbit = item.properties.get('sat:relative_orbit', 'N/A')
-            f.write(f"  Orbit Direction: {orbit_state}\n")
-            f.write(f"  Relative Orbit: {relative_orbit}\n")
-            
-            # Cloud cover
-            cloud_cover = item.properties.get('eo:cloud_cover', 'N/A')
-            if cloud_cover != 'N/A':
-                f.write(f"  Cloud Cover: {cloud_cover:.2f}%\n")
-            else:
-                f.write(f"  Cloud Cover: N/A\n")
-            
-            # Processing level
-            processing_level = item.properties.get('s2:processing_baseline', 'N/A')
-            f.write(f"  Processing Baseline: {processing_level}\n")
-            
-            # MGRS tile
-            mgrs_tile = item.properties.get('s2:mgrs_tile', 'N/A')
-            f.write(f"  MGRS Tile: {mgrs_tile}\n")
-        
-        # Processing Information
-        f.write("\n" + "-" * 70 + "\n")
-        f.write("PROCESSING INFORMATION\n")
-        f.write("-" * 70 + "\n")
-        f.write(f"Normalization Method: Official Sentinel Hub (linear gain)\n")
-        f.write(f"Gain Factor: 2.5\n")
-        f.write(f"Compression (GeoTIFF): LZW\n")
-        f.write(f"JPEG Quality: {config['output']['jpg_quality']}\n")
-        f.write(f"Max Cloud Cover Filter: {config['sentinel2']['max_cloud_cover']}%\n")
-        f.write(f"Min AOI Coverage: {config['sentinel2']['min_aoi_coverage']}%\n\n")
-        
-        f.write("=" * 70 + "\n")
-        f.write("End of Metadata\n")
-        f.write("=" * 70 + "\n")
+        f.write("".join(parts))
     
     print(f"  Saved metadata: {doc_path}")
 
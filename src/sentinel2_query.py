@@ -2,8 +2,8 @@
 
 import pystac_client
 import planetary_computer
+import shapely
 from shapely.geometry import shape
-from shapely.ops import unary_union
 from collections import defaultdict
 
 
@@ -20,7 +20,7 @@ def search_sentinel2_images(bounds, start_date, end_date, max_cloud_cover, aoi_g
     Returns:
         dict: Dictionary with dates as keys and list of STAC items as values
     """
-    from src.aoi_handler import check_coverage
+    from src.aoi_handler import check_coverage_many
     
     catalog = pystac_client.Client.open(
         "https://planetarycomputer.microsoft.com/api/stac/v1",
@@ -39,20 +39,24 @@ def search_sentinel2_images(bounds, start_date, end_date, max_cloud_cover, aoi_g
     items = list(search.items())
     print(f"Found {len(items)} Sentinel-2 tiles with cloud cover < {max_cloud_cover}%")
     
-    # Group items by date
+    # Group items by date, parsing each tile footprint once
     items_by_date = defaultdict(list)
+    footprints_by_date = defaultdict(list)
     for item in items:
         date_str = item.properties.get('datetime', '')[:10]
         items_by_date[date_str].append(item)
+        footprints_by_date[date_str].append(shape(item.geometry))
     
     print(f"\nGrouped into {len(items_by_date)} unique dates")
     
-    # Check coverage for merged tiles per date
+    # Footprint union per date, then the coverage of all dates in vectorized calls
+    dates = sorted(items_by_date)
+    merged_geoms = [shapely.union_all(footprints_by_date[date]) for date in dates]
+    coverage_pcts, covered = check_coverage_many(aoi_geometry, merged_geoms)
+    
     fully_covered_dates = {}
-    for date, date_items in sorted(items_by_date.items()):
-        # Merge geometries of all tiles for this date
-        merged_geom = unary_union([shape(item.geometry) for item in date_items])
-        coverage_pct, is_covered = check_coverage(aoi_geometry, merged_geom)
+    for date, coverage_pct, is_covered in zip(dates, coverage_pcts, covered):
+        date_items = items_by_date[date]
         
         avg_cloud = sum(item.properties.get('eo:cloud_cover', 0) for item in date_items) / len(date_items)
         